@@ -19,7 +19,10 @@ def _print_help() -> None:
         "                              specified pattern(s).\n"
         "  tag-version                 Tag your repo with the python package "
         "version, if a tag for\n"
-        "                              that version doesn't already exist."
+        "                              that version doesn't already exist.\n"
+        "  serve                       Run a daemon which keeps repositories "
+        "and versions warm\n"
+        "                              between commands."
     )
 
 
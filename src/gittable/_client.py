@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import stat
+from http.client import HTTPConnection, HTTPResponse
+from tempfile import gettempdir
+from typing import Any
+from urllib.parse import urlparse
+
+# The port used by `gittable serve` on platforms without unix sockets
+DEFAULT_PORT: int = 52217
+# How long to wait for a connection to the server before assuming it isn't
+# running, in seconds
+CONNECT_TIMEOUT: float = 1.0
+
+
+def _check_owner(path: str) -> None:
+    """
+    Raise a `PermissionError` if `path` is not owned by the current user
+    (on platforms with user IDs)
+    """
+    if hasattr(os, "getuid") and os.lstat(path).st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by another user")
+
+
+def get_directory(*, create: bool = False) -> str:
+    """
+    Get the directory, private to the current user, in which `gittable
+    serve` creates its socket and token files.
+
+    Parameters:
+        create: If `True`, create the directory if it doesn't exist, and
+            verify that only the current user can access it
+
+    Raises:
+        PermissionError: If `create` is `True`, and the directory exists,
+            but is not a directory which only the current user can access
+    """
+    directory: str
+    if hasattr(os, "getuid"):
+        directory = os.path.join(
+            os.environ.get("XDG_RUNTIME_DIR", "") or gettempdir(),
+            f"gittable-{os.getuid()}",
+        )
+    else:
+        directory = os.path.join(
+            os.environ.get("LOCALAPPDATA", "") or os.path.expanduser("~"),
+            "gittable",
+        )
+    if create:
+        if not os.path.lexists(directory):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if hasattr(os, "getuid"):
+            _check_owner(directory)
+            mode: int = os.lstat(directory).st_mode
+            if not stat.S_ISDIR(mode) or stat.S_IMODE(mode) & 0o077:
+                raise PermissionError(
+                    f"{directory} must be a directory accessible only by "
+                    "its owner"
+                )
+    return directory
+
+
+def get_token_path(port: int) -> str:
+    """
+    Get the path of the file containing the token which clients must present
+    to a `gittable serve` daemon listening on a localhost HTTP port
+    """
+    return os.path.join(get_directory(), f"token-{port}")
+
+
+def get_default_address() -> str:
+    """
+    Get the address on which `gittable serve` listens by default: a unix
+    socket in a directory private to the current user, where supported,
+    otherwise a localhost HTTP port.
+    """
+    if hasattr(socket, "AF_UNIX"):
+        return f"unix:{os.path.join(get_directory(), 'gittable.sock')}"
+    return f"http://127.0.0.1:{DEFAULT_PORT}"
+
+
+def get_address() -> str:
+    """
+    Get the address of the `gittable serve` daemon which the CLI should
+    use, from the `GITTABLE_SERVER` environment variable, if defined,
+    otherwise the default address. Setting `GITTABLE_SERVER` to an empty
+    string disables use of the daemon.
+    """
+    return os.environ.get("GITTABLE_SERVER", get_default_address())
+
+
+def parse_address(address: str) -> tuple[str, str, int]:
+    """
+    Parse an address of the form "unix:PATH" or "http://HOST:PORT", and
+    return a tuple containing the scheme ("unix" or "http"), the socket path
+    or host name, and the port (0 for unix sockets).
+
+    Raises:
+        ValueError: If the address is not of either form
+    """
+    if address.startswith("unix:") and address[5:]:
+        return "unix", address[5:], 0
+    if address.startswith("http://"):
+        try:
+            parse_result = urlparse(address)
+            return (
+                "http",
+                parse_result.hostname or "127.0.0.1",
+                parse_result.port or DEFAULT_PORT,
+            )
+        except ValueError:
+            pass
+    raise ValueError(
+        f"Invalid gittable server address: {address!r} (expected "
+        '"unix:PATH" or "http://HOST:PORT")'
+    )
+
+
+class _UnixHTTPConnection(HTTPConnection):
+    """
+    An HTTP connection over a unix socket
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__("localhost")
+        self.path: str = path
+
+    def connect(self) -> None:
+        # Don't send requests to a socket created by another user
+        _check_owner(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(CONNECT_TIMEOUT)
+        self.sock.connect(self.path)
+        # Requests can take as long as a clone, so only connecting
+        # is subject to a timeout
+        self.sock.settimeout(None)
+
+
+class _TCPHTTPConnection(HTTPConnection):
+    """
+    An HTTP connection which only applies a timeout while connecting
+    """
+
+    def connect(self) -> None:
+        self.sock = socket.create_connection(
+            (self.host, self.port), CONNECT_TIMEOUT
+        )
+        self.sock.settimeout(None)
+
+
+def call(command: str, address: str | None = None, **arguments: Any) -> Any:
+    """
+    Call a `gittable serve` API function, and return the result.
+
+    Parameters:
+
+    - command (str): "download" or "tag_version"
+    - address (str|None): The server address. If not provided, the address
+      is determined by `get_address`.
+    - arguments: Keyword arguments for the API function
+
+    Raises:
+
+    - ConnectionError: If a connection to the server could not be
+      established (or the client is disabled), in which case the caller
+      should perform the operation locally
+    - RuntimeError: If the server encountered an error performing the
+      operation, or the connection was lost
+    - ValueError: If the address is invalid
+    """
+    if address is None:
+        address = get_address()
+    if not address:
+        raise ConnectionError(address)
+    scheme, host, port = parse_address(address)
+    headers: dict[str, str] = {"Content-Type": "application/json"}
+    connection: HTTPConnection
+    try:
+        if scheme == "unix":
+            connection = _UnixHTTPConnection(host)
+        else:
+            connection = _TCPHTTPConnection(host, port)
+            # A server listening on a port must be sent the token it wrote
+            # to a file only the current user can read
+            token_path: str = get_token_path(port)
+            _check_owner(token_path)
+            with open(token_path) as token_file:
+                headers["Authorization"] = f"Bearer {token_file.read()}"
+        connection.connect()
+    except OSError as error:
+        raise ConnectionError(address) from error
+    try:
+        # Once connected, the request may already be in progress, so the
+        # caller should not fall back to performing it locally
+        try:
+            connection.request(
+                "POST",
+                f"/{command}",
+                body=json.dumps(arguments).encode("utf-8"),
+                headers=headers,
+            )
+            response: HTTPResponse = connection.getresponse()
+            body: dict[str, Any] = json.loads(response.read() or b"{}")
+        except OSError as error:
+            raise RuntimeError(
+                f"Lost connection to the gittable server at {address}"
+            ) from error
+        if response.status != 200:  # noqa: PLR2004
+            raise RuntimeError(body.get("error", response.reason))
+        return body["result"]
+    finally:
+        connection.close()
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import atexit
+import os
+import re
+import sys
+from glob import glob
+from shlex import quote
+from shutil import rmtree
+from subprocess import DEVNULL, CalledProcessError, call
+from tempfile import mkdtemp
+from threading import Lock
+from urllib.parse import urlparse
+
+from gittable._utilities import check_output, update_url_user_password
+
+# The default number of seconds for which an idle SSH connection is kept
+# open for re-use by subsequent git commands
+_DEFAULT_POOL_LIFETIME: int = 60
+# The pool lifetime set by `set_pool_lifetime`, which takes precedence over
+# the `GITTABLE_POOL_LIFETIME` environment variable
+_pool_lifetime: int | None = None
+_control_directory: str = ""
+_control_directory_lock: Lock = Lock()
+# A credential helper which reads credentials from environment variables,
+# so that secrets are not written in URLs, git configuration, or command
+# line arguments. Note: `printf` is used rather than `echo`, which
+# interprets backslash escapes in some shells (such as dash).
+_CREDENTIAL_HELPER: str = (
+    '!f() { test "$1" = get && '
+    "printf '%s\\n' "
+    '"username=${GITTABLE_USERNAME}" "password=${GITTABLE_PASSWORD}"; }; f'
+)
+
+
+def set_pool_lifetime(seconds: int) -> None:
+    """
+    Set the number of seconds for which an idle SSH connection is kept open
+    for re-use by subsequent git commands, overriding the
+    `GITTABLE_POOL_LIFETIME` environment variable (which defaults to 60).
+    A value of 0 disables connection re-use.
+    """
+    global _pool_lifetime  # noqa: PLW0603
+    _pool_lifetime = seconds
+
+
+def _get_pool_lifetime() -> int:
+    """
+    Get the number of seconds for which an idle SSH connection is kept open.
+    A value of 0 disables multiplexing.
+    """
+    if _pool_lifetime is not None:
+        return _pool_lifetime
+    value: str = os.environ.get("GITTABLE_POOL_LIFETIME", "").strip()
+    if not value:
+        return _DEFAULT_POOL_LIFETIME
+    try:
+        return int(value)
+    except ValueError:
+        print(  # noqa: T201
+            f"Invalid GITTABLE_POOL_LIFETIME: {value!r} (expected an "
+            f"integer number of seconds), using {_DEFAULT_POOL_LIFETIME}",
+            file=sys.stderr,
+        )
+        return _DEFAULT_POOL_LIFETIME
+
+
+def _close_connections() -> None:
+    """
+    Close all SSH master connections, and remove their control sockets
+    """
+    path: str
+    for path in glob(os.path.join(_control_directory, "*")):
+        call(
+            ("ssh", "-o", f"ControlPath={path}", "-O", "exit", "localhost"),
+            stdout=DEVNULL,
+            stderr=DEVNULL,
+        )
+    rmtree(_control_directory, ignore_errors=True)
+
+
+def _get_control_directory() -> str:
+    """
+    Get the directory in which SSH control sockets are created, creating it
+    if it doesn't exist yet
+    """
+    global _control_directory  # noqa: PLW0603
+    with _control_directory_lock:
+        if not _control_directory:
+            # Unix socket paths are limited to ~104 characters, so a short
+            # directory path is preferred
+            _control_directory = mkdtemp(
+                prefix="gittable_ssh_",
+                dir="/tmp" if os.path.isdir("/tmp") else None,  # noqa: S108
+            )
+            atexit.register(_close_connections)
+        return _control_directory
+
+
+def _get_ssh_command(env: dict[str, str], pool_lifetime: int) -> str:
+    """
+    Get the SSH command git would use, with options added to share one
+    connection per host between git commands
+    """
+    ssh_command: str = env.get("GIT_SSH_COMMAND", "")
+    if not ssh_command:
+        try:
+            ssh_command = check_output(
+                ("git", "config", "--get", "core.sshCommand")
+            ).strip()
+        except CalledProcessError:
+            ssh_command = ""
+    control_path: str = os.path.join(_get_control_directory(), "%C")
+    return (
+        f"{ssh_command or 'ssh'} -o ControlMaster=auto "
+        f"-o {quote(f'ControlPath={control_path}')} "
+        f"-o ControlPersist={pool_lifetime}"
+    )
+
+
+def _is_http_url(url: str) -> bool:
+    return bool(re.match(r"https?://", url, flags=re.IGNORECASE))
+
+
+def _get_credential_url(url: str) -> str:
+    """
+    Get the scheme and host (with port, if any) of an HTTP(S) URL, which
+    git matches against `credential.<url>.*` configuration
+    """
+    parse_result = urlparse(url)
+    return "{}://{}".format(
+        parse_result.scheme.lower(),
+        parse_result.netloc.rpartition("@")[-1].lower(),
+    )
+
+
+def _is_ssh_url(url: str) -> bool:
+    if "://" in url:
+        return urlparse(url).scheme.lower() in ("ssh", "git+ssh", "ssh+git")
+    # SCP-like syntax ([user@]host:path), excluding windows drive letters
+    return bool(re.match(r"[^/:\\]{2,}:", url))
+
+
+def prepare_remote(
+    url: str,
+    user: str = "",
+    password: str = "",
+) -> tuple[str, tuple[str, ...], dict[str, str]]:
+    """
+    Prepare to run a git command against a remote repository, re-using
+    SSH connections to the same host across git commands, and passing
+    HTTP(S) credentials through a credential helper rather than the URL.
+
+    Note: Git cannot keep an HTTP connection open after the command
+    using it exits, so HTTP(S) connections are only re-used within each git
+    command.
+
+    Parameters:
+
+    - url (str): The remote repository URL
+    - user (str) = "": (optional)
+    - password (str) = "": (optional)
+
+    Returns:
+
+    A tuple containing the URL to pass to git, options to insert
+    before the git sub-command, and environment variables for the git
+    process.
+
+    Raises:
+
+    - ValueError: If the user or password contains a line break or null
+      character, which can't be passed to git
+    """
+    options: tuple[str, ...] = ()
+    env: dict[str, str] = os.environ.copy()
+    if re.search(r"[\r\n\0]", user + password):
+        # These would be interpreted as the end of a value by git's
+        # credential protocol, and could be used to inject attributes
+        raise ValueError(
+            "The user and password may not contain line breaks or null "
+            "characters"
+        )
+    if user or password:
+        if _is_http_url(url):
+            # The helper only applies to the requested host, and replaces
+            # (rather than supplementing) any other helpers configured for
+            # it, so that other credentials are neither used nor stored
+            credential_url: str = _get_credential_url(url)
+            options = (
+                "-c",
+                f"credential.{credential_url}.helper=",
+                "-c",
+                f"credential.{credential_url}.helper={_CREDENTIAL_HELPER}",
+            )
+            env["GITTABLE_USERNAME"] = user
+            env["GITTABLE_PASSWORD"] = password
+            # Credentials were provided, so prompting for them is pointless
+            env["GIT_TERMINAL_PROMPT"] = "0"
+        else:
+            url = update_url_user_password(url, user, password)
+    # Connection multiplexing is only supported by OpenSSH on posix systems,
+    # and a custom `GIT_SSH` program may not be OpenSSH
+    pool_lifetime: int = _get_pool_lifetime()
+    if (
+        pool_lifetime > 0
+        and os.name != "nt"
+        and "GIT_SSH" not in env
+        and _is_ssh_url(url)
+    ):
+        env["GIT_SSH_COMMAND"] = _get_ssh_command(env, pool_lifetime)
+    return url, options, env
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 import sys
-from subprocess import DEVNULL, PIPE, list2cmdline, run
+from subprocess import DEVNULL, PIPE, Popen, list2cmdline, run
 from traceback import format_exception
-from typing import TYPE_CHECKING, Callable
+from typing import IO, TYPE_CHECKING, Callable, cast
 from urllib.parse import ParseResult, urlparse, urlunparse
 from urllib.parse import quote as _quote
 
 if TYPE_CHECKING:
+    from collections.abc import Generator, Iterable, Iterator
     from pathlib import Path
 
 
@@ -88,3 +89,56 @@ def check_output(
     if echo:
         print(output)  # noqa: T201
     return output
+
+
+def read_cat_file_blobs(
+    process: Popen[bytes], object_hashes: Iterable[str]
+) -> Iterator[bytes]:
+    """
+    Yield the content of each blob, read using a running
+    `git cat-file --batch` process.
+
+    Parameters:
+
+    - process (subprocess.Popen): A `git cat-file --batch` process, with
+      stdin and stdout pipes
+    - object_hashes (Iterable[str]): The hashes of the blobs to read
+    """
+    stdin: IO[bytes] = cast(IO[bytes], process.stdin)
+    stdout: IO[bytes] = cast(IO[bytes], process.stdout)
+    object_hash: str
+    for object_hash in object_hashes:
+        stdin.write(f"{object_hash}\n".encode())
+        stdin.flush()
+        size: int = int(stdout.readline().split()[2])
+        content: bytes = stdout.read(size)
+        # Discard the trailing line feed, so the process is ready for the
+        # next request even if the caller stops iterating
+        stdout.read(1)
+        yield content
+
+
+def iter_blobs(
+    directory: str | Path, object_hashes: Iterable[str]
+) -> Generator[bytes, None, None]:
+    """
+    Yield the content of each blob, using a single `git cat-file --batch`
+    process.
+
+    Parameters:
+
+    - directory (str|Path): A directory within the git repository
+    - object_hashes (Iterable[str]): The hashes of the blobs to read
+    """
+    process: Popen[bytes] = Popen(
+        ("git", "cat-file", "--batch"),
+        stdin=PIPE,
+        stdout=PIPE,
+        cwd=directory,
+    )
+    try:
+        yield from read_cat_file_blobs(process, object_hashes)
+    finally:
+        cast(IO[bytes], process.stdin).close()
+        cast(IO[bytes], process.stdout).close()
+        process.wait()
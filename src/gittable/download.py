@@ -1,25 +1,404 @@
 from __future__ import annotations
 
 import argparse
+import bz2
+import gzip
+import lzma
 import os
+import re
+import sys
+import tarfile
+import time
+import zipfile
+from contextlib import ExitStack, closing
+from functools import partial
 from glob import iglob
+from io import BytesIO
 from itertools import chain
 from pathlib import Path
 from shutil import move, rmtree
 from subprocess import check_call
 from tempfile import mkdtemp
-from typing import TYPE_CHECKING
+from typing import IO, TYPE_CHECKING, Any, Callable, cast
 
-from gittable._utilities import update_url_user_password
+from gittable._client import call
+from gittable._transport import prepare_remote
+from gittable._utilities import check_output, iter_blobs
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable, Iterator
+    from collections.abc import Generator, Iterable, Iterator
+
+# Archive formats, keyed by every recognized file name suffix
+_ARCHIVE_FORMAT_SUFFIXES: dict[str, str] = {
+    ".tar": "tar",
+    ".tar.gz": "tar.gz",
+    ".tgz": "tar.gz",
+    ".tar.bz2": "tar.bz2",
+    ".tbz2": "tar.bz2",
+    ".tar.xz": "tar.xz",
+    ".txz": "tar.xz",
+    ".zip": "zip",
+}
+_ARCHIVE_FORMATS: tuple[str, ...] = (
+    "tar",
+    "tar.gz",
+    "tar.bz2",
+    "tar.xz",
+    "zip",
+)
 
 
 def _iglob_recursive(pathname: str) -> Iterator[str]:
     return iglob(pathname, recursive=True)
 
 
+def _translate_glob_part(part: str) -> str:
+    """
+    Translate one path component of a glob pattern into a regular
+    expression which will not match across a path separator
+    """
+    expression: str = ""
+    index: int = 0
+    length: int = len(part)
+    while index < length:
+        character: str = part[index]
+        index += 1
+        if character == "*":
+            expression += "[^/]*"
+        elif character == "?":
+            expression += "[^/]"
+        elif character == "[":
+            # Like `fnmatch` (used by `glob.iglob`), only "!" negates a set
+            end: int = index
+            if end < length and part[end] == "!":
+                end += 1
+            if end < length and part[end] == "]":
+                end += 1
+            end = part.find("]", end)
+            if end == -1:
+                expression += re.escape(character)
+            else:
+                characters: str = part[index:end]
+                index = end + 1
+                negate: str = ""
+                if characters.startswith("!"):
+                    negate = "^"
+                    characters = characters[1:]
+                # Escape characters which have (or may, in future python
+                # versions, have) a special meaning in a regular
+                # expression set, leaving ranges intact
+                characters = re.sub(r"([\\\[\]^&~|])", r"\\\1", characters)
+                expression += f"[{negate}{characters}]"
+        else:
+            expression += re.escape(character)
+    # Like `glob.iglob`, wildcards don't match hidden files or directories
+    if part.startswith(".") or not re.search(r"[*?\[]", part):
+        return expression
+    return f"(?!\\.){expression}"
+
+
+def _glob_to_regex(pattern: str) -> re.Pattern[str]:
+    """
+    Translate a recursive glob pattern into a compiled regular expression
+    matching relative, "/"-delimited file paths in the same manner as
+    `glob.iglob(pattern, recursive=True)`
+    """
+    pattern = pattern.replace(os.path.sep, "/")
+    # Like `glob.iglob`, a pattern with a trailing separator only matches
+    # directories, so it can't match any file
+    if pattern.endswith("/"):
+        return re.compile(r"(?!)")
+    parts: list[str] = [
+        part for part in pattern.split("/") if part not in ("", ".")
+    ]
+    expression: str = ""
+    index: int
+    part: str
+    for index, part in enumerate(parts):
+        if part == "**":
+            if index == len(parts) - 1:
+                expression += r"(?:[^/.][^/]*/)*[^/.][^/]*"
+            else:
+                expression += r"(?:[^/.][^/]*/)*"
+        else:
+            expression += _translate_glob_part(part)
+            if index < len(parts) - 1:
+                expression += "/"
+    return re.compile(f"{expression}\\Z")
+
+
+def _get_archive_format(archive: str, archive_format: str = "") -> str:
+    """
+    Get the archive format, inferring it from the archive file name
+    if not explicitly provided
+    """
+    if archive_format:
+        suffix: str = f".{archive_format.lower().lstrip('.')}"
+        if suffix not in _ARCHIVE_FORMAT_SUFFIXES:
+            raise ValueError(archive_format)
+        return _ARCHIVE_FORMAT_SUFFIXES[suffix]
+    if archive == "-":
+        return "tar"
+    name: str
+    for suffix, name in _ARCHIVE_FORMAT_SUFFIXES.items():
+        if archive.lower().endswith(suffix):
+            return name
+    raise ValueError(archive)
+
+
+def _iter_tree(
+    directory: str,
+    revision: str = "HEAD",
+) -> Iterator[tuple[int, str, str]]:
+    """
+    Yield a tuple containing the file mode, blob hash, and relative path of
+    every file in the `revision` commit of the repository in `directory`, in
+    the order in which git sorts them
+    """
+    entry: str
+    for entry in check_output(
+        ("git", "ls-tree", "-r", "-z", "--full-tree", revision), cwd=directory
+    ).split("\0"):
+        if not entry:
+            continue
+        metadata, path = entry.split("\t", 1)
+        mode, object_type, object_hash = metadata.split(" ")
+        # Submodules are referenced as commits, and have no content here
+        if object_type == "blob":
+            yield int(mode, 8), object_hash, path
+
+
+def _get_tree_entries(
+    directory: str,
+    files: Iterable[str],
+    revision: str = "HEAD",
+) -> tuple[tuple[int, str, str], ...]:
+    """
+    Get the file mode, blob hash, and relative path of every file in the
+    `revision` commit of the repository in `directory` matching one or more
+    of the glob patterns in `files`
+    """
+    patterns: tuple[re.Pattern[str], ...] = tuple(map(_glob_to_regex, files))
+    return tuple(
+        entry
+        for entry in _iter_tree(directory, revision)
+        if any(pattern.match(entry[2]) for pattern in patterns)
+    )
+
+
+def _write_tar(
+    file: IO[bytes],
+    entries: tuple[tuple[int, str, str], ...],
+    contents: Iterable[bytes],
+    mtime: int,
+) -> None:
+    with tarfile.open(fileobj=file, mode="w|") as tar:
+        mode: int
+        path: str
+        content: bytes
+        for (mode, _, path), content in zip(entries, contents):
+            tar_info: tarfile.TarInfo = tarfile.TarInfo(path)
+            tar_info.mtime = mtime
+            tar_info.uid = tar_info.gid = 0
+            tar_info.uname = tar_info.gname = ""
+            if mode == 0o120000:
+                tar_info.type = tarfile.SYMTYPE
+                tar_info.linkname = content.decode("utf-8", errors="ignore")
+                tar_info.mode = 0o777
+                tar.addfile(tar_info)
+            else:
+                tar_info.mode = mode & 0o777
+                tar_info.size = len(content)
+                tar.addfile(tar_info, BytesIO(content))
+
+
+def _write_zip(
+    file: IO[bytes],
+    entries: tuple[tuple[int, str, str], ...],
+    contents: Iterable[bytes],
+    mtime: int,
+) -> None:
+    date_time: tuple[int, ...] = time.gmtime(mtime)[:6]
+    with zipfile.ZipFile(file, mode="w") as zip_file:
+        mode: int
+        path: str
+        content: bytes
+        for (mode, _, path), content in zip(entries, contents):
+            zip_info: zipfile.ZipInfo = zipfile.ZipInfo(
+                path,
+                date_time=date_time,  # type: ignore[arg-type]
+            )
+            zip_info.compress_type = zipfile.ZIP_DEFLATED
+            zip_info.create_system = 3  # Unix, so permissions are honored
+            zip_info.external_attr = (mode & 0xFFFF) << 16
+            zip_file.writestr(zip_info, content)
+
+
+def _write_archive(
+    archive: str,
+    archive_format: str,
+    directory: str,
+    files: Iterable[str],
+    revision: str = "HEAD",
+    read_blobs: Callable[[Iterable[str]], Generator[bytes, None, None]]
+    | None = None,
+) -> list[str]:
+    """
+    Write the files in the `revision` commit of the repository in `directory`
+    which match `files` to an archive, streaming blob content directly from
+    git, and return the archived paths.
+
+    Files are written in git's tree order, with the commit time as
+    their modification time, so that identical inputs produce identical
+    archives.
+    """
+    entries: tuple[tuple[int, str, str], ...] = _get_tree_entries(
+        directory, files, revision
+    )
+    mtime: int = int(
+        check_output(
+            ("git", "log", "-1", "--format=%ct", revision), cwd=directory
+        ).strip()
+    )
+    with ExitStack() as stack:
+        # The blob reader is closed explicitly, rather than when garbage
+        # collected, since it may hold a lock or process until then
+        contents: Iterable[bytes] = stack.enter_context(
+            closing(
+                (read_blobs or partial(iter_blobs, directory))(
+                    entry[1] for entry in entries
+                )
+            )
+        )
+        file: IO[bytes]
+        if archive == "-":
+            file = sys.stdout.buffer
+        else:
+            file = stack.enter_context(open(archive, "wb"))
+        if archive_format == "zip":
+            _write_zip(file, entries, contents, mtime)
+        else:
+            # Note: The gzip header's timestamp is fixed to the commit time,
+            # rather than the current time, so that output is reproducible
+            if archive_format == "tar.gz":
+                file = cast(
+                    IO[bytes],
+                    stack.enter_context(
+                        gzip.GzipFile(
+                            filename="", mode="wb", fileobj=file, mtime=mtime
+                        )
+                    ),
+                )
+            elif archive_format == "tar.bz2":
+                file = cast(
+                    IO[bytes],
+                    stack.enter_context(bz2.BZ2File(file, mode="wb")),
+                )
+            elif archive_format == "tar.xz":
+                file = cast(
+                    IO[bytes],
+                    stack.enter_context(lzma.LZMAFile(file, mode="wb")),
+                )
+            _write_tar(file, entries, contents, mtime)
+        file.flush()
+    return [entry[2] for entry in entries]
+
+
+def _write_files(
+    directory: str,
+    files: Iterable[str],
+    target_directory: str,
+    revision: str = "HEAD",
+    read_blobs: Callable[[Iterable[str]], Generator[bytes, None, None]]
+    | None = None,
+) -> list[str]:
+    """
+    Write the files in the `revision` commit of the repository in `directory`
+    which match `files` under `target_directory`, streaming blob content
+    directly from git, and return the paths written
+    """
+    entries: tuple[tuple[int, str, str], ...] = _get_tree_entries(
+        directory, files, revision
+    )
+    paths: list[str] = []
+    mode: int
+    relative_path: str
+    content: bytes
+    contents: Generator[bytes, None, None] = (
+        read_blobs or partial(iter_blobs, directory)
+    )(entry[1] for entry in entries)
+    # The blob reader is closed explicitly, rather than when garbage
+    # collected, since it may hold a lock or process until then
+    with closing(contents):
+        for (mode, _, relative_path), content in zip(entries, contents):
+            path: str = os.path.join(
+                target_directory, *relative_path.split("/")
+            )
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.lexists(path):
+                os.remove(path)
+            if mode == 0o120000:
+                os.symlink(content.decode("utf-8", errors="ignore"), path)
+            else:
+                with open(path, "wb") as file:
+                    file.write(content)
+                if mode & 0o111:
+                    os.chmod(path, 0o755)  # noqa: S103
+            paths.append(path)
+    return paths
+
+
+def _clone(
+    repo: str,
+    branch: str = "",
+    user: str = "",
+    password: str = "",
+    *,
+    checkout: bool = True,
+) -> str:
+    """
+    Shallow clone a repository into a temp directory, and return the
+    path of that directory
+    """
+    options: tuple[str, ...]
+    env: dict[str, str]
+    repo, options, env = prepare_remote(repo, user, password)
+    temp_directory: str = mkdtemp(prefix="git_download_")
+    check_call(
+        ("git", *options, "clone", "-q", "--depth", "1", "--single-branch")
+        + (("-b", branch) if branch else ())
+        + (() if checkout else ("--no-checkout",))
+        + (repo, temp_directory),
+        env=env,
+    )
+    return temp_directory
+
+
+def _download_archive(
+    repo: str,
+    files: Iterable[str],
+    archive: Path | str,
+    archive_format: str = "",
+    branch: str = "",
+    user: str = "",
+    password: str = "",
+) -> list[str]:
+    """
+    Download files matching `files` from a git repository into an archive
+    """
+    archive = str(archive)
+    archive_format = _get_archive_format(archive, archive_format)
+    if archive != "-":
+        archive = os.path.abspath(archive)
+    # Files are read directly from the object database, so there is no need
+    # to check out a working tree
+    temp_directory: str = _clone(repo, branch, user, password, checkout=False)
+    try:
+        return _write_archive(archive, archive_format, temp_directory, files)
+    finally:
+        rmtree(temp_directory, ignore_errors=True)
+
+
 def download(
     repo: str,
     files: Iterable[str] = ("**",),
@@ -27,11 +406,19 @@ def download(
     branch: str = "",
     user: str = "",
     password: str = "",
+    archive: Path | str | None = None,
+    archive_format: str = "",
 ) -> list[str]:
     """
     Download files from a git repository and return a list of the files
     downloaded.
 
+    If an `archive` is provided, matched files are streamed directly from
+    git into a tar or zip archive (no files are written to a destination
+    directory), and the returned list contains the archived relative paths.
+    Archive members are ordered and time-stamped deterministically,
+    so downloading the same commit twice produces identical archives.
+
     Parameters:
         repo: A git URL, as you would pass to `git clone`
         files: One or more
@@ -42,10 +429,22 @@ def download(
         branch: A branch from which to retrieve (if not provided,
             files will be retrieved from HEAD)
         user:
-        password:
+        password: HTTP(S) passwords are passed to git through a
+            credential helper, rather than being embedded in the URL
+        archive: The path of an archive file to create, or "-" to write
+            the archive to stdout
+        archive_format: One of "tar", "tar.gz", "tar.bz2", "tar.xz", or
+            "zip". If not provided, the format is inferred from the `archive`
+            file name (archives written to stdout default to "tar").
     """
     if isinstance(files, str):
         files = (files,)
+    if archive is not None:
+        if directory:
+            raise ValueError(directory, archive)
+        return _download_archive(
+            repo, files, archive, archive_format, branch, user, password
+        )
     if directory:
         if isinstance(directory, Path):
             directory = str(directory.absolute())
@@ -53,15 +452,8 @@ def download(
             directory = os.path.abspath(directory)
     else:
         directory = os.path.abspath(os.path.curdir)
-    if user or password:
-        repo = update_url_user_password(repo, user, password)
     # Shallow clone into a temp directory
-    temp_directory: str = mkdtemp(prefix="git_download_")
-    check_call(
-        ("git", "clone", "-q", "--depth", "1", "--single-branch")
-        + (("-b", branch) if branch else ())
-        + (repo, temp_directory)
-    )
+    temp_directory: str = _clone(repo, branch, user, password)
     # Remove the git directory, so those files aren't accidentally matched
     rmtree(os.path.join(temp_directory, ".git"), ignore_errors=True)
     current_directory: str = os.path.abspath(os.path.curdir)
@@ -121,6 +513,26 @@ def main() -> None:  # pragma: no cover
             "directory."
         ),
     )
+    parser.add_argument(
+        "-a",
+        "--archive",
+        default=None,
+        type=str,
+        help=(
+            "Write matched files to this tar or zip archive, instead of "
+            'to a directory. Use "-" to write the archive to stdout.'
+        ),
+    )
+    parser.add_argument(
+        "-f",
+        "--archive-format",
+        default="",
+        choices=_ARCHIVE_FORMATS,
+        help=(
+            "The archive format. If not provided, the format is inferred "
+            'from the archive file name ("tar" when writing to stdout).'
+        ),
+    )
     parser.add_argument(
         "-u",
         "--user",
@@ -147,14 +559,33 @@ def main() -> None:  # pragma: no cover
         ),
     )
     namespace: argparse.Namespace = parser.parse_args()
-    download(
-        namespace.repo,
-        files=namespace.file or ("**",),
-        directory=namespace.directory,
-        branch=namespace.branch,
-        user=namespace.user,
-        password=namespace.password,
-    )
+    archive: str | None = namespace.archive
+    directory: str = namespace.directory
+    # Paths are made absolute, since they may be resolved by a server
+    if archive is None:
+        directory = os.path.abspath(directory or os.path.curdir)
+    elif archive != "-":
+        archive = os.path.abspath(archive)
+    arguments: dict[str, Any] = {
+        "repo": namespace.repo,
+        "files": namespace.file or ["**"],
+        "directory": directory,
+        "branch": namespace.branch,
+        "user": namespace.user,
+        "password": namespace.password,
+        "archive": archive,
+        "archive_format": namespace.archive_format,
+    }
+    # Use the `gittable serve` daemon, if it's running, except when writing
+    # to stdout
+    if archive != "-":
+        try:
+            call("download", **arguments)
+        except ConnectionError:
+            pass
+        else:
+            return
+    download(**arguments)
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -0,0 +1,652 @@
+from __future__ import annotations
+
+import argparse
+import hmac
+import ipaddress
+import json
+import os
+import secrets
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager, suppress
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from shutil import rmtree
+from socketserver import ThreadingMixIn, UnixStreamServer
+from subprocess import PIPE, Popen, check_call
+from tempfile import mkdtemp
+from threading import Lock
+from typing import IO, TYPE_CHECKING, Any, Callable, cast
+from urllib.parse import urlsplit
+
+from gittable._client import (
+    _check_owner,
+    get_default_address,
+    get_directory,
+    get_token_path,
+    parse_address,
+)
+from gittable._transport import prepare_remote, set_pool_lifetime
+from gittable._utilities import (
+    check_output,
+    get_exception_text,
+    read_cat_file_blobs,
+)
+from gittable.download import (
+    _get_archive_format,
+    _write_archive,
+    _write_files,
+)
+from gittable.tag_version import _get_project_state, _tag_version
+
+if TYPE_CHECKING:
+    from collections.abc import Generator, Iterable, Iterator
+    from socketserver import BaseServer
+    from urllib.parse import SplitResult
+
+
+class _Repository:
+    """
+    A shallow clone of a remote repository, which is kept warm between
+    requests. Concurrent fetches of the same repository are coalesced, and
+    blobs are read through a persistent `git cat-file --batch` process.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        branch: str = "",
+        user: str = "",
+        password: str = "",
+        *,
+        verbose: bool = False,
+    ) -> None:
+        self.branch: str = branch
+        self.verbose: bool = verbose
+        # The URL as requested, without credentials added by
+        # `prepare_remote`, for logging
+        self._requested_url: str = url
+        self._options: tuple[str, ...]
+        self._env: dict[str, str]
+        self.url, self._options, self._env = prepare_remote(
+            url, user, password
+        )
+        self.directory: str = mkdtemp(prefix="gittable_serve_")
+        check_call(("git", "init", "-q", "--bare", self.directory))
+        check_call(
+            ("git", "remote", "add", "origin", self.url), cwd=self.directory
+        )
+        # Automatic garbage collection could remove objects still being read
+        check_call(("git", "config", "gc.auto", "0"), cwd=self.directory)
+        self.commit: str = ""
+        self.fetched: float = 0.0
+        # The number of requests using the repository, and when it was last
+        # used, which are maintained by `_Cache`
+        self.users: int = 0
+        self.used: float = time.monotonic()
+        self._lock: Lock = Lock()
+        self._fetch: Future[str] | None = None
+        self._cat_file_lock: Lock = Lock()
+        self._cat_file: Popen[bytes] | None = None
+
+    def fetch(self, max_age: float = 0.0) -> str:
+        """
+        Fetch the branch (or the remote HEAD) and return the hash of the
+        fetched commit. If another request is already fetching this
+        repository, wait for, and share, the result of that fetch. If the
+        last fetch completed less than `max_age` seconds ago, return the
+        commit from that fetch without fetching again.
+        """
+        future: Future[str] | None
+        with self._lock:
+            if self.commit and (time.monotonic() - self.fetched) < max_age:
+                return self.commit
+            future = self._fetch
+            if future is None:
+                self._fetch = Future()
+        if future is not None:
+            return future.result()
+        future = cast("Future[str]", self._fetch)
+        if self.verbose:
+            print(  # noqa: T201
+                f"Fetching {self.branch or 'HEAD'} from {self._requested_url}",
+                file=sys.stderr,
+            )
+        try:
+            check_call(
+                (
+                    "git",
+                    *self._options,
+                    "fetch",
+                    "-q",
+                    "--depth",
+                    "1",
+                    "origin",
+                    self.branch or "HEAD",
+                ),
+                cwd=self.directory,
+                env=self._env,
+            )
+            commit: str = check_output(
+                ("git", "rev-parse", "FETCH_HEAD"), cwd=self.directory
+            ).strip()
+        except BaseException as error:
+            with self._lock:
+                self._fetch = None
+            future.set_exception(error)
+            raise
+        with self._lock:
+            self._fetch = None
+            self.commit = commit
+            self.fetched = time.monotonic()
+        future.set_result(commit)
+        return commit
+
+    def read_blobs(
+        self, object_hashes: Iterable[str]
+    ) -> Generator[bytes, None, None]:
+        """
+        Yield the content of each blob. The generator holds a lock until
+        closed, so callers should close it when done.
+        """
+        with self._cat_file_lock:
+            if self._cat_file is None or self._cat_file.poll() is not None:
+                self._cat_file = Popen(
+                    ("git", "cat-file", "--batch"),
+                    stdin=PIPE,
+                    stdout=PIPE,
+                    cwd=self.directory,
+                )
+            yield from read_cat_file_blobs(self._cat_file, object_hashes)
+
+    def close(self) -> None:
+        with self._cat_file_lock:
+            if self._cat_file is not None:
+                cast(IO[bytes], self._cat_file.stdin).close()
+                self._cat_file.wait()
+                cast(IO[bytes], self._cat_file.stdout).close()
+                self._cat_file = None
+        rmtree(self.directory, ignore_errors=True)
+
+
+class _Cache:
+    """
+    State shared between requests: warm repositories, and resolved project
+    versions
+    """
+
+    def __init__(
+        self,
+        max_age: float = 0.0,
+        repository_lifetime: float = 600.0,
+        max_repositories: int = 32,
+        *,
+        verbose: bool = False,
+    ) -> None:
+        self.max_age: float = max_age
+        self.verbose: bool = verbose
+        self.repository_lifetime: float = repository_lifetime
+        self.max_repositories: int = max_repositories
+        self._lock: Lock = Lock()
+        self._repositories: dict[tuple[str, ...], _Repository] = {}
+        # The state hash, and version, last resolved for each project
+        # directory
+        self._versions: dict[str, tuple[str, str]] = {}
+
+    @contextmanager
+    def _use_repository(
+        self,
+        url: str,
+        branch: str = "",
+        user: str = "",
+        password: str = "",
+    ) -> Iterator[_Repository]:
+        """
+        Get a warm repository, creating it if necessary, which won't be
+        evicted while in use
+        """
+        # Credentials are part of the key, so that requests can't read a
+        # repository fetched with someone else's credentials
+        key: tuple[str, ...] = (url, branch, user, password)
+        with self._lock:
+            repository: _Repository | None = self._repositories.get(key)
+            if repository is not None:
+                repository.users += 1
+        if repository is None:
+            # Creating a repository runs git, so the lock isn't held, and if
+            # another request created the same repository in the meantime,
+            # that one is used instead
+            new_repository: _Repository = _Repository(
+                *key, verbose=self.verbose
+            )
+            with self._lock:
+                repository = self._repositories.setdefault(key, new_repository)
+                repository.users += 1
+            if repository is not new_repository:
+                new_repository.close()
+        try:
+            yield repository
+        finally:
+            with self._lock:
+                repository.users -= 1
+                repository.used = time.monotonic()
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Close repositories which are not in use, and either haven't been
+        used for `repository_lifetime` seconds, or are the least recently
+        used in excess of `max_repositories`
+        """
+        evicted: list[_Repository] = []
+        with self._lock:
+            expired: float = time.monotonic() - self.repository_lifetime
+            unused: list[tuple[tuple[str, ...], _Repository]] = sorted(
+                (
+                    (key, repository)
+                    for key, repository in self._repositories.items()
+                    if not repository.users
+                ),
+                key=lambda item: item[1].used,
+            )
+            excess: int = len(self._repositories) - self.max_repositories
+            key: tuple[str, ...]
+            repository: _Repository
+            for key, repository in unused:
+                if excess <= 0 and repository.used > expired:
+                    break
+                evicted.append(self._repositories.pop(key))
+                excess -= 1
+        # Closing a repository removes its directory, so the lock isn't held
+        for repository in evicted:
+            repository.close()
+
+    def download(
+        self,
+        repo: str,
+        files: Iterable[str] = ("**",),
+        directory: str = "",
+        branch: str = "",
+        user: str = "",
+        password: str = "",
+        archive: str | None = None,
+        archive_format: str = "",
+    ) -> list[str]:
+        """
+        Perform `gittable.download.download` using a warm repository.
+        Paths must be absolute, since they are resolved by the server.
+        """
+        if isinstance(files, str):
+            files = (files,)
+        if archive == "-":
+            # The server can't write to the client's stdout
+            raise ValueError(archive)
+        if archive is not None and directory:
+            raise ValueError(directory, archive)
+        repository: _Repository
+        with self._use_repository(repo, branch, user, password) as repository:
+            commit: str = repository.fetch(self.max_age)
+            if archive is not None:
+                return _write_archive(
+                    os.path.abspath(archive),
+                    _get_archive_format(archive, archive_format),
+                    repository.directory,
+                    files,
+                    commit,
+                    repository.read_blobs,
+                )
+            return _write_files(
+                repository.directory,
+                files,
+                os.path.abspath(directory or os.path.curdir),
+                commit,
+                repository.read_blobs,
+            )
+
+    def tag_version(
+        self,
+        directory: str,
+        message: str | None = None,
+        prefix: str | None = None,
+        suffix: str | None = None,
+        version: str | None = None,
+        state: str | None = None,
+    ) -> str | None:
+        """
+        Perform `gittable.tag_version.tag_version` with the version
+        previously resolved for the project's current commit, tags, and
+        working tree state, or with `version`, if provided. The directory
+        must be absolute, since it is resolved by the server.
+
+        Versions are never resolved by the server, since resolving a
+        version can install the project into the current environment, which
+        should be the client's. If no version is provided, and none is cached
+        for the project's state, `None` is returned, and the client should
+        resolve the version and call again.
+
+        Parameters:
+            version: A version resolved by the client, to tag and cache
+            state: The state (see `gittable.tag_version._get_project_state`)
+                from which `version` was resolved. If not provided, the
+                current state is assumed.
+        """
+        directory = str(Path(directory).resolve())
+        if version:
+            state = state or _get_project_state(directory)
+            with self._lock:
+                self._versions[directory] = (state, version)
+        else:
+            cached: tuple[str, str] | None
+            with self._lock:
+                cached = self._versions.get(directory)
+            if cached is None or cached[0] != _get_project_state(directory):
+                return None
+            version = cached[1]
+        return _tag_version(
+            directory,
+            version,
+            message=message,
+            prefix=prefix,
+            suffix=suffix,
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            repository: _Repository
+            for repository in self._repositories.values():
+                repository.close()
+            self._repositories.clear()
+            self._versions.clear()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    Handle a JSON API request of the form `POST /<command>`, with keyword
+    arguments for the command in the request body
+    """
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else ""
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        if cast("_ServerMixIn", self.server).verbose:
+            super().log_message(format, *args)
+
+    def _respond(self, status: int, body: dict[str, Any]) -> None:
+        data: bytes = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _get_request_error(self) -> tuple[int, str] | None:
+        """
+        Get the status and error message with which to reject a request
+        which may not have been sent by the `gittable` client, if any
+        """
+        # Browsers can't send JSON to another origin without a CORS
+        # preflight request, which this server doesn't answer
+        if self.headers.get_content_type() != "application/json":
+            return 415, "The content type must be application/json"
+        # Reject requests for other host names, to prevent DNS rebinding
+        if not _is_loopback(urlsplit(f"//{self.headers.get('Host', '')}")):
+            return 403, "The host must be localhost"
+        token: str = cast("_ServerMixIn", self.server).token
+        if token and not hmac.compare_digest(
+            self.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            return 403, "Invalid or missing token"
+        return None
+
+    def do_POST(self) -> None:  # noqa: N802
+        request_error: tuple[int, str] | None = self._get_request_error()
+        if request_error is not None:
+            self._respond(request_error[0], {"error": request_error[1]})
+            return
+        cache: _Cache = cast("_ServerMixIn", self.server).cache
+        command: str = self.path.strip("/")
+        if command not in ("download", "tag_version"):
+            self._respond(404, {"error": f"Unknown command: {command}"})
+            return
+        function: Callable[..., Any] = getattr(cache, command)
+        try:
+            arguments: dict[str, Any] = json.loads(
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                or b"{}"
+            )
+            self._respond(200, {"result": function(**arguments)})
+        except Exception:  # noqa: BLE001
+            self._respond(500, {"error": get_exception_text()})
+
+
+class _ServerMixIn:
+    cache: _Cache
+    verbose: bool = False
+    # The token clients must present, if listening on a port
+    token: str = ""
+    daemon_threads: bool = True
+
+    def service_actions(self) -> None:
+        # Evict idle repositories, even when no requests are being made
+        self.cache.evict()
+
+
+class _HTTPServer(_ServerMixIn, ThreadingHTTPServer):
+    pass
+
+
+class _UnixHTTPServer(_ServerMixIn, ThreadingMixIn, UnixStreamServer):
+    def get_request(self) -> tuple[socket.socket, Any]:
+        request, _ = super().get_request()
+        return request, ("",)
+
+
+def _is_loopback(url: SplitResult) -> bool:
+    """
+    Determine if a URL's host is "localhost" or a loopback IP address
+    """
+    hostname: str = url.hostname or ""
+    if hostname == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(hostname).is_loopback
+    except ValueError:
+        return False
+
+
+def _get_server(address: str) -> BaseServer:
+    scheme, host, port = parse_address(address)
+    if scheme == "http":
+        # Any local user can connect to a port, so only requests with the
+        # server's token are accepted, however remote hosts should never
+        # be able to connect
+        if not _is_loopback(urlsplit(address)):
+            raise ValueError(
+                f"The server address must be a loopback address: {address}"
+            )
+        return _HTTPServer((host, port), _RequestHandler)
+    if os.path.lexists(host):
+        # Don't replace, or connect to, another user's socket
+        _check_owner(host)
+        # Remove a stale socket left behind by a server which was killed,
+        # but not one in use by a running server
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            try:
+                client.connect(host)
+            except OSError:
+                os.remove(host)
+            else:
+                raise OSError(f"A server is already listening on {host}")
+    # Only the current user should be able to connect to the socket
+    umask: int = os.umask(0o177)
+    try:
+        return _UnixHTTPServer(host, _RequestHandler)
+    finally:
+        os.umask(umask)
+
+
+def serve(
+    address: str | None = None,
+    max_age: float = 0.0,
+    repository_lifetime: float = 600.0,
+    max_repositories: int = 32,
+    *,
+    verbose: bool = False,
+) -> None:
+    """
+    Run a daemon exposing `download` and `tag_version` through a JSON API,
+    keeping repositories, git processes, and resolved versions warm between
+    requests. The `gittable` CLI uses the daemon automatically, when it
+    is running.
+
+    Parameters:
+        address: "unix:PATH" or "http://HOST:PORT". If not provided, a
+            unix socket in the user's runtime (or temp) directory is used,
+            on platforms supporting unix sockets, otherwise
+            "http://127.0.0.1:52217".
+        max_age: The number of seconds for which a fetched repository
+            is considered current. By default, every request fetches,
+            however concurrent requests for the same repository always
+            share one fetch.
+        repository_lifetime: The number of seconds for which an unused
+            repository is kept
+        max_repositories: The maximum number of repositories to keep. When
+            exceeded, the least recently used unused repositories are
+            removed.
+        verbose: If `True`, log requests and fetches to stderr
+    """
+    if not address:
+        # Create the private directory containing the default socket
+        get_directory(create=True)
+        address = get_default_address()
+    server: BaseServer = _get_server(address)
+    cache: _Cache = _Cache(
+        max_age, repository_lifetime, max_repositories, verbose=verbose
+    )
+    cast(_ServerMixIn, server).cache = cache
+    cast(_ServerMixIn, server).verbose = verbose
+    token_path: str = ""
+    if isinstance(server, _HTTPServer):
+        get_directory(create=True)
+        token_path = get_token_path(server.server_address[1])
+        server.token = secrets.token_urlsafe(32)
+        # Replace any token left behind by a server which was killed, and
+        # ensure only the current user can read the new one
+        with suppress(FileNotFoundError):
+            os.remove(token_path)
+        with open(
+            os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600),
+            "w",
+        ) as token_file:
+            token_file.write(server.token)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:  # pragma: no cover
+        pass
+    finally:
+        server.server_close()
+        cache.close()
+        if token_path:
+            with suppress(OSError):
+                os.remove(token_path)
+        if address.startswith("unix:"):
+            with suppress(OSError):
+                os.remove(address[5:])
+
+
+def main() -> None:  # pragma: no cover
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="gittable serve",
+        description=(
+            "Run a daemon which keeps repositories, git processes, and "
+            "project versions warm between `gittable` commands. While the "
+            "daemon is running, `gittable download` and "
+            "`gittable tag-version` use it automatically."
+        ),
+    )
+    parser.add_argument(
+        "-a",
+        "--address",
+        default="",
+        type=str,
+        help=(
+            'The address on which to listen: "unix:PATH" or '
+            '"http://HOST:PORT". If not provided, the GITTABLE_SERVER '
+            "environment variable is used, if defined, otherwise "
+            f"{get_default_address()}."
+        ),
+    )
+    parser.add_argument(
+        "--max-age",
+        default=0.0,
+        type=float,
+        help=(
+            "The number of seconds for which a fetched repository is "
+            "considered current. By default, every request fetches, "
+            "however concurrent requests for the same repository always "
+            "share one fetch."
+        ),
+    )
+    parser.add_argument(
+        "--repository-lifetime",
+        default=600.0,
+        type=float,
+        help=(
+            "The number of seconds for which an unused repository is kept "
+            "(600 by default)."
+        ),
+    )
+    parser.add_argument(
+        "--max-repositories",
+        default=32,
+        type=int,
+        help=(
+            "The maximum number of repositories to keep (32 by default). "
+            "When exceeded, the least recently used unused repositories are "
+            "removed."
+        ),
+    )
+    parser.add_argument(
+        "--pool-lifetime",
+        default=None,
+        type=int,
+        help=(
+            "The number of seconds for which an idle SSH connection is kept "
+            "open for re-use by subsequent requests to the same host. "
+            "If not provided, the GITTABLE_POOL_LIFETIME environment "
+            "variable is used, if defined, otherwise 60. Use 0 to disable "
+            "connection re-use."
+        ),
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Log requests and fetches to stderr",
+    )
+    namespace: argparse.Namespace = parser.parse_args()
+    if namespace.pool_lifetime is not None:
+        set_pool_lifetime(namespace.pool_lifetime)
+    # Shut down cleanly (removing the socket and cached repositories) when
+    # terminated
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    address: str = namespace.address or os.environ.get("GITTABLE_SERVER", "")
+    print(  # noqa: T201
+        f"Listening on {address or get_default_address()}", file=sys.stderr
+    )
+    serve(
+        address,
+        namespace.max_age,
+        namespace.repository_lifetime,
+        namespace.max_repositories,
+        verbose=namespace.verbose,
+    )
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
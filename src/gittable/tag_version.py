@@ -1,10 +1,14 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import os
+import re
 import sys
-from typing import TYPE_CHECKING
+from configparser import ConfigParser
+from contextlib import suppress
+from typing import TYPE_CHECKING, cast
 
 try:
     from functools import cache  # type: ignore
@@ -13,12 +17,64 @@ except ImportError:
 from pathlib import Path
 from shlex import quote
 from shutil import which
-from subprocess import CalledProcessError, list2cmdline
+from subprocess import CalledProcessError, list2cmdline, run
+from threading import Lock
 
-from gittable._utilities import check_output
+from gittable._client import call
+from gittable._utilities import check_output, iter_blobs
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable
+    from collections.abc import Iterable, Iterator
+
+# Files from which a project version can be statically parsed, in order of
+# precedence
+_VERSION_FILE_NAMES: tuple[str, ...] = (
+    "pyproject.toml",
+    "setup.cfg",
+    "setup.py",
+)
+# A PEP 440 version, per `packaging.version.VERSION_PATTERN`
+_VERSION_PATTERN: re.Pattern[str] = re.compile(
+    r"""
+    v?
+    (?:(?P<epoch>[0-9]+)!)?
+    (?P<release>[0-9]+(?:\.[0-9]+)*)
+    (?P<pre>
+        [-_\.]?
+        (?P<pre_l>alpha|a|beta|b|preview|pre|c|rc)
+        [-_\.]?
+        (?P<pre_n>[0-9]+)?
+    )?
+    (?P<post>
+        (?:-(?P<post_n1>[0-9]+))
+        |
+        (?:
+            [-_\.]?
+            (?P<post_l>post|rev|r)
+            [-_\.]?
+            (?P<post_n2>[0-9]+)?
+        )
+    )?
+    (?P<dev>
+        [-_\.]?
+        (?P<dev_l>dev)
+        [-_\.]?
+        (?P<dev_n>[0-9]+)?
+    )?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_\.][a-z0-9]+)*))?
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+# Concurrent `pip install` commands could corrupt the environment they
+# install into
+_pip_lock: Lock = Lock()
+_PRE_RELEASE_LABELS: dict[str, str] = {
+    "alpha": "a",
+    "beta": "b",
+    "c": "rc",
+    "pre": "rc",
+    "preview": "rc",
+}
 
 
 @cache
@@ -40,22 +96,20 @@ def _get_hatch_version(
     if isinstance(directory, str):  # pragma: no cover
         directory = Path(directory)
     directory = str(directory.resolve())
-    current_directory: str = str(Path.cwd().resolve())
-    os.chdir(directory)
     hatch: str = which("hatch") or "hatch"
     output: str = ""
-    try:
-        # Note: We pass an empty dictionary of environment variables
-        # to circumvent configuration issues caused by relative paths
+    # Note: We pass an empty dictionary of environment variables
+    # to circumvent configuration issues caused by relative paths.
+    # The working directory is passed to the subprocess, rather than
+    # changed, so that versions can be resolved concurrently.
+    with suppress(Exception):
         output = (
-            check_output((hatch, "version"), env=_get_env()).strip()
+            check_output(
+                (hatch, "version"), cwd=directory, env=_get_env()
+            ).strip()
             if hatch
             else ""
         )
-    except Exception:  # noqa: S110 BLE001
-        pass
-    finally:
-        os.chdir(current_directory)
     return output
 
 
@@ -67,24 +121,18 @@ def _get_poetry_version(
     """
     if isinstance(directory, Path):  # pragma: no cover
         directory = str(Path(directory).resolve())
-    current_directory: str = str(Path.cwd().resolve())
-    os.chdir(directory)
     poetry: str = which("poetry") or "poetry"
     output: str = ""
-    try:
-        # Note: We pass an empty dictionary of environment variables
-        # to prevent configuration issues caused by relative paths
+    # Note: We pass an empty dictionary of environment variables
+    # to prevent configuration issues caused by relative paths
+    with suppress(Exception):
         output = (
-            check_output((poetry, "version"), env=_get_env())
+            check_output((poetry, "version"), cwd=directory, env=_get_env())
             .strip()
             .rpartition(" ")[-1]
             if poetry
             else ""
         )
-    except Exception:  # noqa: S110 BLE001
-        pass
-    finally:
-        os.chdir(current_directory)
     return output
 
 
@@ -111,18 +159,20 @@ def _get_pip_version(
         )
         env: dict[str, str] = os.environ.copy()
         env.pop("PIP_CONSTRAINT", None)
-        check_output(command, env=env)
-        command = (
-            sys.executable,
-            "-m",
-            "pip",
-            "list",
-            "--format",
-            "json",
-            "--path",
-            directory,
-        )
-        return json.loads(check_output(command, env=_get_env()))[0]["version"]
+        with _pip_lock:
+            check_output(command, env=env)
+            command = (
+                sys.executable,
+                "-m",
+                "pip",
+                "list",
+                "--format",
+                "json",
+                "--path",
+                directory,
+            )
+            packages: str = check_output(command, env=_get_env())
+        return json.loads(packages)[0]["version"]
     except Exception as error:  # pragma: no cover
         output: str = ""
         if isinstance(error, CalledProcessError):
@@ -151,6 +201,51 @@ def _get_python_project_version(
     )
 
 
+def _get_project_state(directory: str) -> str:
+    """
+    Get a hash of the state from which a project's version may be derived:
+    the commit, tags, and working tree
+    """
+    return hashlib.sha256(
+        b"\0".join(
+            check_output(command, cwd=directory).encode()
+            for command in (
+                ("git", "rev-parse", "HEAD"),
+                ("git", "for-each-ref", "refs/tags"),
+                ("git", "status", "--porcelain", "--untracked-files=all"),
+                ("git", "diff", "HEAD", "--no-ext-diff", "--binary"),
+            )
+        )
+    ).hexdigest()
+
+
+def _tag_version(
+    directory: str,
+    version: str,
+    message: str | None = None,
+    prefix: str | None = None,
+    suffix: str | None = None,
+) -> str:
+    """
+    Tag the repository in `directory` with `version`, *if* no pre-existing
+    tag with that version number exists, and return the tag name
+    """
+    if prefix:
+        version = f"{prefix}{version}"
+    if suffix:
+        version = f"{version}{suffix}"
+    tags: Iterable[str] = map(
+        str.strip,
+        check_output(("git", "tag"), cwd=directory).strip().split("\n"),
+    )
+    if version not in tags:  # pragma: no cover
+        check_output(
+            ("git", "tag", "-a", version, "-m", message or version),
+            cwd=directory,
+        )
+    return version
+
+
 def tag_version(
     directory: str | Path = os.path.curdir,
     message: str | None = None,
@@ -173,21 +268,333 @@ def tag_version(
     if isinstance(directory, str):  # pragma: no cover
         directory = Path(directory)
     directory = str(directory.resolve())
-    version: str = _get_python_project_version(directory)
-    if prefix:
-        version = f"{prefix}{version}"
-    if suffix:
-        version = f"{version}{suffix}"
-    tags: Iterable[str] = map(
-        str.strip,
-        check_output(("git", "tag"), cwd=directory).strip().split("\n"),
+    return _tag_version(
+        directory,
+        _get_python_project_version(directory),
+        message=message,
+        prefix=prefix,
+        suffix=suffix,
     )
-    if version not in tags:  # pragma: no cover
+
+
+def _call_tag_version(
+    directory: str | Path = os.path.curdir,
+    message: str | None = None,
+    prefix: str | None = None,
+    suffix: str | None = None,
+    address: str | None = None,
+) -> str:
+    """
+    Perform `tag_version` using a `gittable serve` daemon, which re-uses the
+    version previously resolved for the project's current state. If the
+    daemon has no such version, the version is resolved here, rather than by
+    the daemon, since resolving a version can install the project into the
+    current environment.
+
+    Raises:
+        ConnectionError: If the daemon isn't running
+    """
+    directory = str(Path(directory).resolve())
+    arguments: dict[str, str | None] = {
+        "directory": directory,
+        "message": message,
+        "prefix": prefix,
+        "suffix": suffix,
+    }
+    tag: str | None = call("tag_version", address=address, **arguments)
+    if tag is None:
+        # The state is captured before resolving the version, so that the
+        # version isn't cached for a state it wasn't resolved from
+        state: str = _get_project_state(directory)
+        tag = call(
+            "tag_version",
+            address=address,
+            version=_get_python_project_version(directory),
+            state=state,
+            **arguments,
+        )
+    return cast(str, tag)
+
+
+def _get_pyproject_toml_version(text: str) -> str:
+    """
+    Parse the static version from the text of a `pyproject.toml` file,
+    from either the `[project]` or `[tool.poetry]` table.
+
+    Note: This is a minimal line-based parser, since `tomllib` is not
+    available in python 3.9, and only needs to support version declarations
+    formatted as `version = "..."`.
+    """
+    versions: dict[str, str] = {}
+    table: str = ""
+    line: str
+    for line in text.splitlines():
+        line = line.strip()  # noqa: PLW2901
+        if line.startswith("["):
+            table = re.sub(r"[\s\"']", "", line.partition("#")[0])
+            continue
+        match: re.Match[str] | None = re.match(
+            r"version\s*=\s*([\"'])(.*?)\1", line
+        )
+        if match:
+            versions.setdefault(table, match.group(2))
+    return versions.get("[project]", "") or versions.get("[tool.poetry]", "")
+
+
+def _get_setup_cfg_version(text: str) -> str:
+    """
+    Parse the static version from the text of a `setup.cfg` file
+    """
+    parser: ConfigParser = ConfigParser(interpolation=None)
+    try:
+        parser.read_string(text)
+    except Exception:  # noqa: BLE001
+        return ""
+    version: str = parser.get("metadata", "version", fallback="").strip()
+    # Versions read from a module attribute or file are not static
+    if version.startswith(("attr:", "file:")):
+        return ""
+    return version
+
+
+def _get_setup_py_version(text: str) -> str:
+    """
+    Parse the static version from the text of a `setup.py` file
+    """
+    match: re.Match[str] | None = re.search(
+        r"\bversion\s*=\s*([\"'])([^\"']+)\1", text
+    )
+    return match.group(2) if match else ""
+
+
+def _normalize_version(version: str) -> str:
+    """
+    Normalize a version number to its canonical PEP 440 form (as reported by
+    `hatch`, `poetry`, and `pip`), so that, for example, "1.0.0-beta"
+    becomes "1.0.0b0". Versions which are not valid per PEP 440 are
+    returned unaltered.
+    """
+    match: re.Match[str] | None = _VERSION_PATTERN.fullmatch(version.strip())
+    if not match:
+        return version
+    normalized: str = ""
+    if match.group("epoch") and int(match.group("epoch")):
+        normalized = f"{int(match.group('epoch'))}!"
+    normalized += ".".join(
+        str(int(number)) for number in match.group("release").split(".")
+    )
+    if match.group("pre"):
+        label: str = match.group("pre_l").lower()
+        normalized += (
+            f"{_PRE_RELEASE_LABELS.get(label, label)}"
+            f"{int(match.group('pre_n') or 0)}"
+        )
+    if match.group("post"):
+        post_number: str = match.group("post_n1") or match.group("post_n2")
+        normalized += f".post{int(post_number or 0)}"
+    if match.group("dev"):
+        normalized += f".dev{int(match.group('dev_n') or 0)}"
+    if match.group("local"):
+        normalized += "+" + ".".join(
+            str(int(part)) if part.isdigit() else part.lower()
+            for part in re.split(r"[-_\.]", match.group("local"))
+        )
+    return normalized
+
+
+def _get_static_version(file_name: str, text: str) -> str:
+    version: str
+    if file_name == "pyproject.toml":
+        version = _get_pyproject_toml_version(text)
+    elif file_name == "setup.cfg":
+        version = _get_setup_cfg_version(text)
+    else:
+        version = _get_setup_py_version(text)
+    return _normalize_version(version) if version else ""
+
+
+def _iter_version_file_changes(
+    directory: str,
+) -> Iterator[tuple[str, dict[str, str]]]:
+    """
+    Yield a tuple for each commit (oldest first, following only the first
+    parent of merges) which altered a file from which the project version
+    can be parsed. Each tuple contains the commit hash and a dictionary
+    mapping the name of each version file existing in that commit to its
+    blob hash.
+    """
+    prefix: str = check_output(
+        ("git", "rev-parse", "--show-prefix"), cwd=directory
+    ).strip()
+    paths: dict[str, str] = {
+        f"{prefix}{file_name}": file_name for file_name in _VERSION_FILE_NAMES
+    }
+    blobs: dict[str, str] = {}
+    commit: str = ""
+    tokens: Iterator[str] = iter(
         check_output(
-            ("git", "tag", "-a", version, "-m", message or version),
+            (
+                "git",
+                "log",
+                "--reverse",
+                "--first-parent",
+                # Show merge commit changes relative to their first parent
+                "-m",
+                "--no-renames",
+                "--no-abbrev",
+                "--raw",
+                "-z",
+                "--format=%x00%H",
+                "--",
+                *_VERSION_FILE_NAMES,
+            ),
+            cwd=directory,
+        ).split("\0")
+    )
+    token: str
+    for token in tokens:
+        token = token.strip()  # noqa: PLW2901
+        if token.startswith(":"):
+            # A raw diff line, followed by the path it describes:
+            # ":<old mode> <new mode> <old hash> <new hash> <status>"
+            path: str = next(tokens)
+            object_hash, status = token.split()[3:5]
+            if status == "D":
+                blobs.pop(paths[path], None)
+            else:
+                blobs[paths[path]] = object_hash
+        elif token:
+            if commit:
+                yield commit, dict(blobs)
+            commit = token
+    if commit:
+        yield commit, blobs
+
+
+def _iter_version_changes(directory: str) -> Iterator[tuple[str, str]]:
+    """
+    Yield a tuple containing the commit hash and version for every commit
+    (oldest first) where the statically declared project version changed
+    """
+    commits: tuple[tuple[str, dict[str, str]], ...] = tuple(
+        _iter_version_file_changes(directory)
+    )
+    object_hashes: tuple[str, ...] = tuple(
+        {
+            object_hash: None
+            for _, blobs in commits
+            for object_hash in blobs.values()
+        }
+    )
+    texts: dict[str, str] = dict(
+        zip(
+            object_hashes,
+            (
+                blob.decode("utf-8", errors="ignore")
+                for blob in iter_blobs(directory, object_hashes)
+            ),
+        )
+    )
+    previous_version: str = ""
+    commit: str
+    blobs: dict[str, str]
+    for commit, blobs in commits:
+        version: str = ""
+        file_name: str
+        for file_name in _VERSION_FILE_NAMES:
+            if file_name in blobs:
+                version = _get_static_version(
+                    file_name, texts[blobs[file_name]]
+                )
+                if version:
+                    break
+        if version and version != previous_version:
+            yield commit, version
+        previous_version = version or previous_version
+
+
+def _create_tags(
+    directory: str,
+    tags: Iterable[tuple[str, str]],
+    message: str | None = None,
+) -> None:
+    """
+    Create annotated tags for many commits at once, using a single
+    `git fast-import` process
+    """
+    tagger: str = check_output(
+        ("git", "var", "GIT_COMMITTER_IDENT"), cwd=directory
+    ).strip()
+    stream: list[bytes] = []
+    tag: str
+    commit: str
+    for tag, commit in tags:
+        data: bytes = f"{message or tag}\n".encode()
+        stream.append(
+            f"tag {tag}\nfrom {commit}\ntagger {tagger}\n"
+            f"data {len(data)}\n".encode()
+        )
+        stream.append(data)
+    if stream:
+        run(
+            ("git", "fast-import", "--quiet"),
+            input=b"".join(stream),
             cwd=directory,
+            check=True,
         )
-    return version
+
+
+def backfill_version_tags(
+    directory: str | Path = os.path.curdir,
+    message: str | None = None,
+    prefix: str | None = None,
+    suffix: str | None = None,
+    *,
+    dry_run: bool = False,
+) -> list[tuple[str, str]]:
+    """
+    Tag every commit in your project's history where the package version
+    changed, *if* no pre-existing tag with that version number exists.
+
+    Rather than checking out each commit and running a build tool, this
+    function scans history for changes to `pyproject.toml`, `setup.cfg`,
+    and `setup.py` in a single pass, and parses each version statically.
+    Only versions declared literally in these files (not dynamic versions)
+    are detected. Only the first parent of each merge commit is followed.
+
+    Parameters:
+        directory:
+        message: The tag message. If not provided, the tag name is used.
+        prefix:
+        suffix:
+        dry_run: If `True`, return the tags which would be created,
+            but do not create them.
+
+    Returns:
+        A list of tuples, each containing the tag name (the version number,
+        including any prefix or suffix) and the hash of the tagged commit,
+        oldest first.
+    """
+    if isinstance(directory, str):  # pragma: no cover
+        directory = Path(directory)
+    directory = str(directory.resolve())
+    existing_tags: set[str] = set(
+        map(
+            str.strip,
+            check_output(("git", "tag"), cwd=directory).strip().split("\n"),
+        )
+    )
+    tags: list[tuple[str, str]] = []
+    commit: str
+    version: str
+    for commit, version in _iter_version_changes(directory):
+        tag: str = f"{prefix or ''}{version}{suffix or ''}"
+        if tag not in existing_tags:
+            existing_tags.add(tag)
+            tags.append((tag, commit))
+    if not dry_run:
+        _create_tags(directory, tags, message)
+    return tags
 
 
 def main() -> None:  # pragma: no cover
@@ -230,15 +637,55 @@ def main() -> None:  # pragma: no cover
         type=str,
         help="A string with which to suffix the version number in the tag.",
     )
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help=(
+            "Tag every commit in the project's history where the version "
+            "changed (statically declared versions only), instead of only "
+            "the current commit."
+        ),
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help=(
+            "With --backfill, list the tags which would be created, without "
+            "creating them."
+        ),
+    )
     arguments: argparse.Namespace = parser.parse_args()
-    print(  # noqa: T201
-        tag_version(
+    if arguments.dry_run and not arguments.backfill:
+        parser.error("--dry-run can only be used with --backfill")
+    if arguments.backfill:
+        tag: str
+        commit: str
+        for tag, commit in backfill_version_tags(
+            directory=arguments.directory,
+            message=arguments.message,
+            suffix=arguments.suffix,
+            prefix=arguments.prefix,
+            dry_run=arguments.dry_run,
+        ):
+            print(tag, commit)  # noqa: T201
+        return
+    version: str
+    # Use the `gittable serve` daemon, if it's running
+    try:
+        version = _call_tag_version(
             directory=arguments.directory,
             message=arguments.message,
             suffix=arguments.suffix,
             prefix=arguments.prefix,
         )
-    )
+    except ConnectionError:
+        version = tag_version(
+            directory=arguments.directory,
+            message=arguments.message,
+            suffix=arguments.suffix,
+            prefix=arguments.prefix,
+        )
+    print(version)  # noqa: T201
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -1,6 +1,11 @@
 from __future__ import annotations
 
 import os
+import tarfile
+import warnings
+import zipfile
+from io import BytesIO
+from pathlib import Path
 from shutil import rmtree
 from subprocess import check_output
 from tempfile import mkdtemp
@@ -54,5 +59,83 @@ def test_git_download() -> None:
         rmtree(temp_directory, ignore_errors=True)
 
 
+def test_git_download_archive() -> None:
+    """
+    Test streaming matched files into an archive with
+    `gittable download --archive`
+    """
+    temp_directory: str = mkdtemp(prefix="test_git_download_archive_")
+    try:
+        # Use this project's local repo as the remote, and create the same
+        # archive twice to verify the output is reproducible
+        repo: str = Path(PROJECT_DIRECTORY).as_uri()
+        archives: list[bytes] = []
+        archive: str
+        for archive in ("a.tar.gz", "b.tar.gz"):
+            archive = os.path.join(temp_directory, archive)
+            paths: list[str] = download(repo, files="**/*.py", archive=archive)
+            assert paths
+            assert all(path.endswith(".py") for path in paths)
+            with tarfile.open(archive) as tar:
+                assert tar.getnames() == paths
+            with open(archive, "rb") as archive_file:
+                archives.append(archive_file.read())
+        assert archives[0] == archives[1]
+        # Nothing should have been written besides the archives
+        assert sorted(os.listdir(temp_directory)) == ["a.tar.gz", "b.tar.gz"]
+        # Zip archives
+        archive = os.path.join(temp_directory, "c.zip")
+        paths = download(repo, files="**/*.py", archive=archive)
+        with zipfile.ZipFile(archive) as zip_file:
+            assert zip_file.namelist() == paths
+        # Patterns with a trailing separator match directories, not files
+        assert not download(
+            repo,
+            files="src/**/",
+            archive=os.path.join(temp_directory, "d.tar"),
+        )
+        # Character sets should be matched as by `glob.iglob`
+        pattern: str
+        for pattern in (
+            "src/gittable/[!_]*.py",
+            "src/gittable/[^_]*.py",
+            "src/gittable/[[]x].py",
+            "src/gittable/[&_|~]*.py",
+        ):
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                paths = download(
+                    repo,
+                    files=pattern,
+                    archive=os.path.join(temp_directory, "e.tar"),
+                )
+            directory: str = os.path.join(temp_directory, "e")
+            assert paths == sorted(
+                Path(os.path.relpath(path, directory)).as_posix()
+                for path in download(repo, files=pattern, directory=directory)
+            )
+            rmtree(directory, ignore_errors=True)
+    finally:
+        rmtree(temp_directory, ignore_errors=True)
+
+
+def test_git_download_archive_stdout(
+    capsysbinary: pytest.CaptureFixture[bytes],
+) -> None:
+    """
+    Test streaming matched files into an archive written to stdout with
+    `gittable download --archive -`
+    """
+    repo: str = Path(PROJECT_DIRECTORY).as_uri()
+    paths: list[str] = download(
+        repo, files="**/*.py", archive="-", archive_format="tar.xz"
+    )
+    assert paths
+    with tarfile.open(
+        fileobj=BytesIO(capsysbinary.readouterr().out), mode="r:xz"
+    ) as tar:
+        assert tar.getnames() == paths
+
+
 if __name__ == "__main__":
     pytest.main(["-vv", __file__])
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from pathlib import Path
+from shutil import rmtree
+from subprocess import Popen, check_call, check_output
+from tempfile import mkdtemp
+from typing import IO
+
+import pytest
+
+from gittable._client import call, get_token_path
+from gittable.download import download
+from gittable.serve import _Cache
+from gittable.tag_version import _call_tag_version
+
+PROJECT_DIRECTORY: Path = Path(__file__).resolve().parent.parent
+TEST_PROJECTS_DIRECTORY: Path = Path(__file__).resolve().parent / "projects"
+
+
+def _get_address(directory: str) -> str:
+    if hasattr(socket, "AF_UNIX"):
+        return f"unix:{os.path.join(directory, 'gittable.sock')}"
+    with socket.socket() as free_port_socket:
+        free_port_socket.bind(("127.0.0.1", 0))
+        port: int = free_port_socket.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def _wait_for_server(address: str, timeout: float = 30.0) -> None:
+    start: float = time.monotonic()
+    while True:
+        try:
+            call("ping", address=address)
+        except ConnectionError:
+            if time.monotonic() - start > timeout:
+                raise
+            time.sleep(0.1)
+        except RuntimeError:
+            # The server is running, and rejected the unknown command
+            return
+
+
+def _init_project(directory: Path) -> None:
+    rmtree(directory / ".git", ignore_errors=True)
+    check_call(("git", "init", "-q"), cwd=directory)
+    check_call(
+        ("git", "config", "--local", "user.email", "you@example.com"),
+        cwd=directory,
+    )
+    check_call(
+        ("git", "config", "--local", "user.name", "Your Name"), cwd=directory
+    )
+    check_call(("git", "add", "."), cwd=directory)
+    check_call(("git", "commit", "-q", "-m", "*"), cwd=directory)
+
+
+def test_serve() -> None:
+    """
+    Test functionality used by the `gittable serve` command
+    """
+    temp_directory: str = mkdtemp(prefix="test_serve_")
+    address: str = _get_address(temp_directory)
+    log_path: str = os.path.join(temp_directory, "serve.log")
+    log: IO[bytes] = open(log_path, "wb")  # noqa: SIM115
+    # Fetched repositories are considered current for long enough that
+    # every request in this test should share one fetch
+    process: Popen[bytes] = Popen(
+        (
+            sys.executable,
+            "-m",
+            "gittable",
+            "serve",
+            "-a",
+            address,
+            "--max-age",
+            "600",
+            "-v",
+        ),
+        stderr=log,
+    )
+    projects: tuple[Path, ...] = (
+        TEST_PROJECTS_DIRECTORY / "test_project_a",
+        TEST_PROJECTS_DIRECTORY / "test_project_b",
+    )
+    try:
+        _wait_for_server(address)
+        repo: str = PROJECT_DIRECTORY.as_uri()
+        # Concurrent requests for the same repository should share a
+        # repository and fetch
+        with ThreadPoolExecutor(4) as executor:
+            results: list[list[str]] = list(
+                executor.map(
+                    lambda index: call(
+                        "download",
+                        address=address,
+                        repo=repo,
+                        files=["**/*.py"],
+                        directory=os.path.join(temp_directory, str(index)),
+                    ),
+                    range(4),
+                )
+            )
+        index: int
+        paths: list[str]
+        for index, paths in enumerate(results):
+            assert paths
+            assert all(path.endswith(".py") for path in paths)
+            assert all(os.path.isfile(path) for path in paths)
+            assert sorted(
+                os.path.relpath(path, os.path.join(temp_directory, str(index)))
+                for path in paths
+            ) == sorted(
+                os.path.relpath(path, os.path.join(temp_directory, "0"))
+                for path in results[0]
+            )
+        # Archives created by the server should be identical to those
+        # created locally
+        archives: list[bytes] = []
+        archive: str
+        for archive in ("served.tar.gz", "local.tar.gz"):
+            archive = os.path.join(temp_directory, archive)
+            if archive.endswith("served.tar.gz"):
+                call(
+                    "download",
+                    address=address,
+                    repo=repo,
+                    files=["**/*.py"],
+                    archive=archive,
+                )
+            else:
+                download(repo, files="**/*.py", archive=archive)
+            with open(archive, "rb") as archive_file:
+                archives.append(archive_file.read())
+        assert archives[0] == archives[1]
+        with open(log_path) as log_file:
+            assert sum(line.startswith("Fetching") for line in log_file) == 1
+        # Versions of different projects should be resolved concurrently
+        project: Path
+        for project in projects:
+            _init_project(project)
+        with ThreadPoolExecutor(len(projects)) as executor:
+            assert list(
+                executor.map(
+                    lambda project: _call_tag_version(
+                        project, address=address
+                    ),
+                    projects,
+                )
+            ) == ["0.0.1", "0.0.2"]
+        version: str
+        for project, version in zip(projects, ("0.0.1", "0.0.2")):
+            assert check_output(
+                ("git", "tag"), cwd=project, text=True
+            ).split() == [version]
+        # The CLI should use the server automatically
+        check_call(("git", "tag", "-d", "0.0.1"), cwd=projects[0])
+        assert (
+            check_output(
+                (
+                    sys.executable,
+                    "-m",
+                    "gittable",
+                    "tag-version",
+                    "--prefix",
+                    "v",
+                ),
+                cwd=projects[0],
+                env={**os.environ, "GITTABLE_SERVER": address},
+                text=True,
+            ).strip()
+            == "v0.0.1"
+        )
+        assert check_output(
+            ("git", "tag"), cwd=projects[0], text=True
+        ).split() == ["v0.0.1"]
+        with open(log_path) as log_file:
+            # Each project needed a request to find the version wasn't
+            # cached, and another to tag the version resolved by the client.
+            # Deleting the tag restored the state the version was cached
+            # for, so the CLI only needed one request.
+            assert sum("POST /tag_version" in line for line in log_file) == 5  # noqa: PLR2004
+        # Errors should be raised by the client
+        with pytest.raises(RuntimeError):
+            call(
+                "download",
+                address=address,
+                repo=Path(temp_directory, "nonexistent").as_uri(),
+                directory=temp_directory,
+            )
+        # The client should only fall back to running commands locally
+        # when it can't connect to a server, and reject invalid addresses
+        with pytest.raises(ConnectionError):
+            call(
+                "download",
+                address=f"unix:{os.path.join(temp_directory, 'none.sock')}",
+                repo=repo,
+            )
+        with pytest.raises(ValueError, match="Invalid gittable server"):
+            call("download", address="tcp://127.0.0.1", repo=repo)
+    finally:
+        process.terminate()
+        process.wait()
+        log.close()
+        for project in projects:
+            rmtree(project / ".git", ignore_errors=True)
+        rmtree(temp_directory, ignore_errors=True)
+
+
+def test_serve_http(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test that a `gittable serve` daemon listening on a port only accepts
+    requests from the `gittable` client
+    """
+    temp_directory: str = mkdtemp(prefix="test_serve_http_")
+    # The token file is written to a directory private to the current user
+    monkeypatch.setenv("XDG_RUNTIME_DIR", temp_directory)
+    monkeypatch.setenv("LOCALAPPDATA", temp_directory)
+    with socket.socket() as free_port_socket:
+        free_port_socket.bind(("127.0.0.1", 0))
+        port: int = free_port_socket.getsockname()[1]
+    address: str = f"http://127.0.0.1:{port}"
+    process: Popen[bytes] = Popen(
+        (sys.executable, "-m", "gittable", "serve", "-a", address)
+    )
+    try:
+        _wait_for_server(address)
+        with open(get_token_path(port)) as token_file:
+            token: str = token_file.read()
+        if hasattr(os, "getuid"):
+            assert os.stat(get_token_path(port)).st_mode & 0o077 == 0
+        headers: dict[str, str]
+        for headers in (
+            # No token
+            {"Content-Type": "application/json"},
+            # Not JSON
+            {"Content-Type": "text/plain", "Authorization": f"Bearer {token}"},
+            # Another host name (as in a DNS rebinding attack)
+            {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {token}",
+                "Host": f"example.com:{port}",
+            },
+        ):
+            connection: HTTPConnection = HTTPConnection("127.0.0.1", port)
+            try:
+                connection.request(
+                    "POST",
+                    "/download",
+                    body=json.dumps(
+                        {"repo": PROJECT_DIRECTORY.as_uri()}
+                    ).encode(),
+                    headers=headers,
+                )
+                assert connection.getresponse().status in (403, 415)
+            finally:
+                connection.close()
+        paths: list[str] = call(
+            "download",
+            address=address,
+            repo=PROJECT_DIRECTORY.as_uri(),
+            files=["*.toml"],
+            directory=os.path.join(temp_directory, "download"),
+        )
+        assert paths
+        assert all(path.endswith(".toml") for path in paths)
+    finally:
+        process.terminate()
+        process.wait()
+        rmtree(temp_directory, ignore_errors=True)
+    # The server should only listen on loopback addresses
+    assert Popen(
+        (sys.executable, "-m", "gittable", "serve", "-a", "http://0.0.0.0:0")
+    ).wait()
+
+
+def test_serve_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test that unused repositories are evicted, and that versions are
+    resolved again when any state they may be derived from changes
+    """
+    temp_directory: str = mkdtemp(prefix="test_serve_cache_")
+    cache: _Cache = _Cache(max_repositories=1)
+    try:
+        repository_directories: list[str] = []
+        repo: str
+        for repo in (
+            PROJECT_DIRECTORY.as_uri(),
+            f"{PROJECT_DIRECTORY.as_uri()}/",
+        ):
+            assert cache.download(
+                repo,
+                files=["*.toml"],
+                directory=os.path.join(temp_directory, "download"),
+            )
+            assert len(cache._repositories) == 1  # noqa: SLF001
+            repository_directories.extend(
+                repository.directory
+                for repository in cache._repositories.values()  # noqa: SLF001
+            )
+        assert not os.path.exists(repository_directories[0])
+        assert os.path.exists(repository_directories[1])
+        cache.repository_lifetime = 0
+        cache.evict()
+        assert not cache._repositories  # noqa: SLF001
+        assert not os.path.exists(repository_directories[1])
+        # Versions are cached for the state they were resolved from, and
+        # never resolved by the server
+        project: str = os.path.join(temp_directory, "project")
+        os.makedirs(project)
+        check_call(("git", "init", "-q"), cwd=project)
+        check_call(
+            ("git", "config", "user.email", "you@example.com"), cwd=project
+        )
+        check_call(("git", "config", "user.name", "Your Name"), cwd=project)
+        check_call(
+            ("git", "commit", "-q", "--allow-empty", "-m", "*"), cwd=project
+        )
+        assert cache.tag_version(project) is None
+        assert cache.tag_version(project, version="1.0.0") == "1.0.0"
+        # Creating the tag changed the state
+        assert cache.tag_version(project) is None
+        assert cache.tag_version(project, version="1.0.0") == "1.0.0"
+        assert cache.tag_version(project) == "1.0.0"
+        Path(project, "untracked.txt").write_text("")
+        assert cache.tag_version(project) is None
+    finally:
+        cache.close()
+        rmtree(temp_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    pytest.main(["-vv", __file__])
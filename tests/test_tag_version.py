@@ -2,14 +2,21 @@ from __future__ import annotations
 
 import os
 import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from shutil import rmtree, which
 from subprocess import check_call
+from tempfile import mkdtemp
 
 import pytest
 
 from gittable._utilities import check_output
-from gittable.tag_version import tag_version
+from gittable.tag_version import (
+    _get_python_project_version,
+    backfill_version_tags,
+    tag_version,
+)
 
 TEST_PROJECTS_DIRECTORY: Path = Path(__file__).resolve().parent / "projects"
 GIT: str = which("git") or "git"
@@ -92,5 +99,154 @@ def test_poetry_project_tag_version() -> None:
             raise
 
 
+@pytest.mark.skipif(os.name == "nt", reason="Uses a shell script")
+def test_concurrent_project_versions(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test that versions of different projects can be resolved concurrently
+    (as by `gittable serve`)
+    """
+    directory: Path = Path(mkdtemp(prefix="test_concurrent_project_versions_"))
+    try:
+        # A stand-in for `hatch`, which reports the version declared in
+        # the working directory, slowly enough for calls to overlap
+        bin_directory: Path = directory / "bin"
+        bin_directory.mkdir()
+        (bin_directory / "hatch").write_text(
+            "#!/bin/sh\nsleep 0.5\ncat VERSION\n"
+        )
+        (bin_directory / "hatch").chmod(0o755)
+        monkeypatch.setenv(
+            "PATH", f"{bin_directory}{os.pathsep}{os.environ['PATH']}"
+        )
+        versions: list[str] = ["1.0.0", "2.0.0"]
+        version: str
+        for version in versions:
+            (directory / version).mkdir()
+            (directory / version / "VERSION").write_text(version)
+        current_directory: Path = Path.cwd()
+        with ThreadPoolExecutor(len(versions)) as executor:
+            futures: list[Future[str]] = [
+                executor.submit(
+                    _get_python_project_version, directory / version
+                )
+                for version in versions
+            ]
+            # The working directory of the current process should not be
+            # changed while versions are being resolved
+            time.sleep(0.25)
+            assert Path.cwd() == current_directory
+            assert [future.result() for future in futures] == versions
+    finally:
+        rmtree(directory, ignore_errors=True)
+
+
+def _commit(directory: Path, files: dict[str, str]) -> str:
+    name: str
+    text: str
+    for name, text in files.items():
+        (directory / name).write_text(text)
+    check_call((GIT, "add", "."), cwd=directory)
+    check_call((GIT, "commit", "-q", "-m", "*"), cwd=directory)
+    return check_output((GIT, "rev-parse", "HEAD"), cwd=directory).strip()
+
+
+def test_backfill_version_tags() -> None:
+    """
+    Test functionality used by the `gittable tag-version --backfill` command
+    """
+    directory: Path = Path(mkdtemp(prefix="test_backfill_version_tags_"))
+    try:
+        check_call((GIT, "init", "-q"), cwd=directory)
+        check_call(
+            (GIT, "config", "--local", "user.email", "you@example.com"),
+            cwd=directory,
+        )
+        check_call(
+            (GIT, "config", "--local", "user.name", "Your Name"),
+            cwd=directory,
+        )
+        commit_a: str = _commit(
+            directory,
+            {"setup.cfg": "[metadata]\nname = a\nversion = 0.0.1\n"},
+        )
+        check_call((GIT, "tag", "v0.0.1"), cwd=directory)
+        commit_b: str = _commit(
+            directory,
+            {
+                "pyproject.toml": (
+                    '[project]\nname = "a"\nversion = "0.0.2"\n\n'
+                    '[tool.hatch.envs.default]\nversion = "x"\n'
+                )
+            },
+        )
+        # Changes to other files, or which don't change the version,
+        # shouldn't be tagged
+        _commit(directory, {"README.md": "a"})
+        _commit(directory, {"setup.cfg": "[metadata]\nversion = 0.0.3\n"})
+        # A version changed on a merged branch should be tagged at the
+        # merge commit
+        check_call((GIT, "checkout", "-q", "-b", "branch"), cwd=directory)
+        _commit(
+            directory,
+            {"pyproject.toml": '[tool.poetry]\nversion = "0.1.0"\n'},
+        )
+        check_call((GIT, "checkout", "-q", "-"), cwd=directory)
+        check_call(
+            (GIT, "merge", "-q", "--no-ff", "-m", "*", "branch"),
+            cwd=directory,
+        )
+        commit_c: str = check_output(
+            (GIT, "rev-parse", "HEAD"), cwd=directory
+        ).strip()
+        # Versions should be tagged in their normalized form, and versions
+        # already tagged in their normalized form shouldn't be re-tagged
+        commit_d: str = _commit(
+            directory,
+            {"pyproject.toml": '[project]\nversion = "1.0.0-beta"\n'},
+        )
+        _commit(
+            directory,
+            {"pyproject.toml": '[project]\nversion = "1.0.0-RC.1"\n'},
+        )
+        check_call((GIT, "tag", "v1.0.0rc1"), cwd=directory)
+        assert backfill_version_tags(directory, prefix="v", dry_run=True) == [
+            ("v0.0.2", commit_b),
+            ("v0.1.0", commit_c),
+            ("v1.0.0b0", commit_d),
+        ]
+        assert check_output((GIT, "tag"), cwd=directory).split() == [
+            "v0.0.1",
+            "v1.0.0rc1",
+        ]
+        assert backfill_version_tags(directory, prefix="v") == [
+            ("v0.0.2", commit_b),
+            ("v0.1.0", commit_c),
+            ("v1.0.0b0", commit_d),
+        ]
+        tag: str
+        commit: str
+        for tag, commit in (
+            ("v0.0.1", commit_a),
+            ("v0.0.2", commit_b),
+            ("v0.1.0", commit_c),
+        ):
+            assert (
+                check_output(
+                    (GIT, "rev-list", "-n", "1", tag), cwd=directory
+                ).strip()
+                == commit
+            )
+        # Annotated tags should have been created
+        assert (
+            check_output(
+                (GIT, "cat-file", "-t", "v0.0.2"), cwd=directory
+            ).strip()
+            == "tag"
+        )
+        assert not backfill_version_tags(directory, prefix="v")
+    finally:
+        rmtree(directory, ignore_errors=True)
+
+
 if __name__ == "__main__":
     pytest.main(["-vv", __file__])
@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import base64
+import json
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from shlex import quote
+from shutil import rmtree
+from subprocess import CalledProcessError, check_call, run
+from tempfile import mkdtemp
+from threading import Thread
+from typing import ClassVar
+
+import pytest
+
+from gittable._transport import prepare_remote
+from gittable.download import download
+
+PROJECT_DIRECTORY: Path = Path(__file__).resolve().parent.parent
+# A stand-in for `ssh`, which logs its arguments, and runs the remote
+# command locally
+FAKE_SSH: str = """
+import json
+import os
+import subprocess
+import sys
+
+with open(os.environ["FAKE_SSH_LOG"], "a") as log:
+    log.write(json.dumps(sys.argv[1:]) + "\\n")
+sys.exit(subprocess.call(sys.argv[-1], shell=True))
+"""
+
+
+class _GitHTTPBackendHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in for a git HTTP server, which serves repositories with
+    `git http-backend`, requiring basic authentication
+    """
+
+    protocol_version: str = "HTTP/1.1"
+    project_root: ClassVar[str] = ""
+    authorization: ClassVar[str] = ""
+    paths: ClassVar[list[str]] = []
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        pass
+
+    def _respond(
+        self, status: int, headers: dict[str, str], body: bytes
+    ) -> None:
+        self.send_response(status)
+        name: str
+        value: str
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self) -> None:
+        self.paths.append(self.path)
+        body: bytes = self.rfile.read(
+            int(self.headers.get("Content-Length", 0))
+        )
+        if self.headers.get("Authorization") != self.authorization:
+            self._respond(401, {"WWW-Authenticate": 'Basic realm="git"'}, b"")
+            return
+        path, _, query = self.path.partition("?")
+        output: bytes = run(
+            ("git", "http-backend"),
+            input=body,
+            capture_output=True,
+            check=True,
+            env={
+                **os.environ,
+                "GIT_PROJECT_ROOT": self.project_root,
+                "GIT_HTTP_EXPORT_ALL": "1",
+                "PATH_INFO": path,
+                "QUERY_STRING": query,
+                "REQUEST_METHOD": self.command,
+                "CONTENT_TYPE": self.headers.get("Content-Type", ""),
+                "CONTENT_LENGTH": str(len(body)),
+                "HTTP_CONTENT_ENCODING": self.headers.get(
+                    "Content-Encoding", ""
+                ),
+                "GIT_PROTOCOL": self.headers.get("Git-Protocol", ""),
+                "REMOTE_USER": "user",
+            },
+        ).stdout
+        head, _, content = output.partition(b"\r\n\r\n")
+        headers: dict[str, str] = dict(
+            line.split(": ", 1) for line in head.decode().split("\r\n")
+        )
+        status: int = int(headers.pop("Status", "200").split()[0])
+        self._respond(status, headers, content)
+
+    do_GET = _handle  # noqa: N815
+    do_POST = _handle  # noqa: N815
+
+
+def test_http_credential_helper(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test that HTTP credentials are passed through a credential helper,
+    rather than in the URL
+    """
+    project_root: str = mkdtemp(prefix="test_http_credential_helper_")
+    # A credential helper configured by the user should not be asked for,
+    # or asked to store, credentials for the requested host
+    user_helper_log: str = os.path.join(project_root, "helper.log")
+    global_config: str = os.path.join(project_root, "gitconfig")
+    check_call(
+        (
+            "git",
+            "config",
+            "--file",
+            global_config,
+            "credential.helper",
+            f'!f() {{ echo "$1" >> {quote(user_helper_log)}; }}; f',
+        )
+    )
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", global_config)
+    check_call(
+        (
+            "git",
+            "clone",
+            "-q",
+            "--bare",
+            PROJECT_DIRECTORY.as_uri(),
+            os.path.join(project_root, "repo.git"),
+        )
+    )
+    _GitHTTPBackendHandler.project_root = project_root
+    _GitHTTPBackendHandler.authorization = "Basic {}".format(
+        base64.b64encode(b"user:p@ss word").decode()
+    )
+    server: ThreadingHTTPServer = ThreadingHTTPServer(
+        ("127.0.0.1", 0), _GitHTTPBackendHandler
+    )
+    thread: Thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    directory: str = os.path.join(project_root, "download")
+    try:
+        url: str = f"http://127.0.0.1:{server.server_port}/repo.git"
+        paths: list[str] = download(
+            url,
+            files="**/*.py",
+            directory=directory,
+            user="user",
+            password="p@ss word",
+        )
+        assert paths
+        assert all(path.endswith(".py") for path in paths)
+        assert all("p@ss" not in path for path in _GitHTTPBackendHandler.paths)
+        assert not os.path.exists(user_helper_log)
+        with pytest.raises(CalledProcessError):
+            download(
+                url,
+                files="**/*.py",
+                directory=directory,
+                user="user",
+                password="wrong",
+            )
+        # Passwords should be passed verbatim, even where `sh` interprets
+        # backslash escapes (which could inject credential attributes)
+        password: str = r"p\ss\nhost=example.com\c"
+        _GitHTTPBackendHandler.authorization = "Basic {}".format(
+            base64.b64encode(f"user:{password}".encode()).decode()
+        )
+        assert download(
+            url,
+            files="**/*.py",
+            directory=os.path.join(project_root, "download_backslashes"),
+            user="user",
+            password=password,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+        rmtree(project_root, ignore_errors=True)
+
+
+def test_prepare_remote(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test that credentials are scoped to the requested host, and that
+    credentials or settings which can't be used are rejected
+    """
+    options: tuple[str, ...]
+    _, options, _ = prepare_remote(
+        "https://user@Example.com:8443/repo.git", "user", "password"
+    )
+    assert options[1] == "credential.https://example.com:8443.helper="
+    assert options[3].startswith("credential.https://example.com:8443.helper=")
+    with pytest.raises(ValueError, match="line breaks"):
+        prepare_remote("https://example.com/repo.git", "user", "a\nb")
+    if os.name == "nt":
+        return
+    # An invalid pool lifetime should fall back to the default
+    monkeypatch.setenv("GITTABLE_POOL_LIFETIME", "a minute")
+    monkeypatch.delenv("GIT_SSH", raising=False)
+    env: dict[str, str]
+    _, _, env = prepare_remote("ssh://example.com/repo.git")
+    assert "ControlPersist=60" in env.get("GIT_SSH_COMMAND", "")
+    monkeypatch.setenv("GITTABLE_POOL_LIFETIME", "0")
+    _, _, env = prepare_remote("ssh://example.com/repo.git")
+    assert "ControlPersist" not in env.get("GIT_SSH_COMMAND", "")
+
+
+@pytest.mark.skipif(os.name == "nt", reason="SSH multiplexing is posix-only")
+def test_ssh_connection_reuse(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test that SSH connections are configured to be shared between git
+    commands
+    """
+    temp_directory: str = mkdtemp(prefix="test_ssh_connection_reuse_")
+    try:
+        fake_ssh: str = os.path.join(temp_directory, "fake_ssh.py")
+        with open(fake_ssh, "w") as fake_ssh_file:
+            fake_ssh_file.write(FAKE_SSH)
+        log: str = os.path.join(temp_directory, "ssh.log")
+        monkeypatch.setenv("FAKE_SSH_LOG", log)
+        monkeypatch.setenv(
+            "GIT_SSH_COMMAND", f"{quote(sys.executable)} {quote(fake_ssh)}"
+        )
+        monkeypatch.setenv("GIT_SSH_VARIANT", "ssh")
+        url: str = f"ssh://localhost{PROJECT_DIRECTORY.as_posix()}"
+        index: int
+        for index in range(2):
+            directory: str = os.path.join(temp_directory, str(index))
+            os.makedirs(directory)
+            assert download(url, files="*.toml", directory=directory)
+        with open(log) as log_file:
+            arguments: list[list[str]] = list(map(json.loads, log_file))
+        assert len(arguments) == 2  # noqa: PLR2004
+        control_paths: set[str] = set()
+        ssh_arguments: list[str]
+        for ssh_arguments in arguments:
+            options: dict[str, str] = dict(
+                ssh_arguments[position + 1].split("=", 1)
+                for position, argument in enumerate(ssh_arguments)
+                if argument == "-o" and "=" in ssh_arguments[position + 1]
+            )
+            assert options["ControlMaster"] == "auto"
+            assert options["ControlPath"].endswith("%C")
+            assert int(options["ControlPersist"]) > 0
+            control_paths.add(options["ControlPath"])
+        # Both commands should use the same managed control socket directory
+        assert len(control_paths) == 1
+    finally:
+        rmtree(temp_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    pytest.main(["-vv", __file__])